@@ -1,62 +1,136 @@
 import os
-import google.generativeai as genai
+import asyncio
+import hashlib
+import httpx
 import json
+import string
+from cachetools import TTLCache
+
+# JSON mode (response_mime_type/response_schema) needs Gemini 1.5+; gemini-pro rejects it
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+
+# Structured output schema: Gemini returns the report fields directly as JSON
+REPORT_FIELDS = ["riskLevel", "floodProbability", "droughtSeverity", "forecast", "summary", "recommendation"]
+REPORT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "riskLevel": {"type": "STRING"},
+        "floodProbability": {"type": "INTEGER"},
+        "droughtSeverity": {"type": "STRING"},
+        "forecast": {"type": "STRING"},
+        "summary": {"type": "STRING"},
+        "recommendation": {"type": "STRING"}
+    },
+    "required": REPORT_FIELDS
+}
 
 class AIEngine:
     def __init__(self):
         # In the backend, we read the key from OS environment variables
         # This is much safer than REACT_APP_...
-        api_key = os.getenv("API_KEY") 
-        if not api_key:
+        self.api_key = os.getenv("API_KEY") 
+        if not self.api_key:
             print("⚠️ No API_KEY found in environment variables.")
-        else:
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
-
-    def generate_hydrologist_report(self, reservoir_name, stats):
-        
-        is_anomaly = stats.get('is_anomaly', False)
-        
-        prompt = f"""
-        Act as a Senior Hydrologist. Analyze this reservoir data:
-        
-        Name: {reservoir_name}
-        Season: {stats['season']}
-        Current Volume: {stats['volume']} MCM
-        Max Capacity: {stats['capacity']} MCM
-        Measured Surface Area: {stats['surface_area']} sq km
-        Mean NDWI Index: {stats['ndwi_index']}
-        Anomaly Detected by Isolation Forest: {is_anomaly}
-        
-        Task:
-        1. Calculate percentage fullness.
-        2. Assess flood/drought risk.
-        3. If Anomaly is True, explain why this might be a data error or a flash event.
-        4. Return JSON response.
+
+        # Shared pooled client: keep-alive connections are reused across reports
+        self.client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=30.0
+        )
+
+        # Compact prompt; the response fields come from REPORT_SCHEMA
+        self._tmpl = string.Template(
+            "Senior Hydrologist. Reservoir $n season $s vol $v/$c MCM area $a km² NDWI $i anomaly $an. "
+            "Assess fullness and flood/drought risk; if anomaly, say whether data error or flash event. "
+            "JSON with riskLevel,floodProbability,droughtSeverity,forecast,summary,recommendation."
+        )
+
+        # Reports keyed on (rounded) inputs; one in-flight Gemini call per key
+        self._cache = TTLCache(maxsize=1024, ttl=3600)
+        self._inflight = {}
+
+    def _cache_key(self, reservoir_name, stats):
+        payload = json.dumps({
+            "r": reservoir_name,
+            "v": round(stats['volume'], 1),
+            "c": round(stats['capacity'], 1),
+            "s": stats['season'],
+            "a": bool(stats.get('is_anomaly', False))
+        }, sort_keys=True)
+        return hashlib.blake2b(payload.encode()).hexdigest()
+
+    async def generate_hydrologist_report(self, reservoir_name, stats):
+        key = self._cache_key(reservoir_name, stats)
+        report = self._cache.get(key)
+        if report is None:
+            report = await self._shared_request(key, reservoir_name, stats)
+
+        if report is None:
+            return self._fallback_report()
+        return dict(report)
+
+    async def _shared_request(self, key, reservoir_name, stats):
+        # Concurrent callers for the same key share one Gemini call
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_cache(key, reservoir_name, stats))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_and_cache(self, key, reservoir_name, stats):
+        report = await self._request_report(reservoir_name, stats)
+        if report is not None:
+            self._cache[key] = report
+        return report
+
+    async def _request_report(self, reservoir_name, stats):
+        """
+        Calls Gemini and returns the parsed report, or None if the call fails.
         """
-        
+        if not self.api_key:
+            return None
+
+        prompt = self._tmpl.substitute(
+            n=reservoir_name,
+            s=stats['season'],
+            v=f"{stats['volume']:.2f}",
+            c=f"{stats['capacity']:.2f}",
+            a=f"{stats['surface_area']:.2f}",
+            i=f"{stats['ndwi_index']:.2f}",
+            an=bool(stats.get('is_anomaly', False))
+        )
+
         try:
-            # We use a simplified generation for the demo
-            # In production, use structured output or function calling
-            response = self.model.generate_content(prompt)
-            
-            # Simple mock parsing if the model is chatty
-            # In a real app, ensure JSON mode is on
-            return {
-                "riskLevel": "Moderate" if (stats['volume']/stats['capacity']) < 0.8 else "High",
-                "floodProbability": int((stats['volume']/stats['capacity']) * 100),
-                "droughtSeverity": "Normal",
-                "forecast": "Based on NDWI trends, water levels are stable.",
-                "summary": response.text[:200] + "...",
-                "recommendation": "Continue monitoring inflow channels."
-            }
+            response = await self.client.post(
+                GEMINI_URL,
+                params={"key": self.api_key},
+                json={
+                    "contents": [{"parts": [{"text": prompt}]}],
+                    "generationConfig": {
+                        "response_mime_type": "application/json",
+                        "response_schema": REPORT_SCHEMA
+                    }
+                }
+            )
+            response.raise_for_status()
+            resp = response.json()
+            return json.loads(resp["candidates"][0]["content"]["parts"][0]["text"])
         except Exception as e:
-            # Fallback if AI fails
-            return {
-                "riskLevel": "Low",
-                "floodProbability": 10,
-                "droughtSeverity": "Normal",
-                "forecast": "AI Service Unavailable",
-                "summary": "Could not contact Gemini AI.",
-                "recommendation": "Manual check required."
-            }
+            print(f"Gemini Error: {e}")
+            return None
+
+    def _fallback_report(self):
+        # Fallback if AI fails (not cached, so the next request retries Gemini)
+        return {
+            "riskLevel": "Low",
+            "floodProbability": 10,
+            "droughtSeverity": "Normal",
+            "forecast": "AI Service Unavailable",
+            "summary": "Could not contact Gemini AI.",
+            "recommendation": "Manual check required."
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,58 @@
+import asyncio
+import torch
+
+class BatchRunner:
+    """
+    Micro-batches concurrent LSTM forecast requests.
+    Requests queued within `max_wait` seconds (up to `max_batch`) run through
+    the model as one (B, 12, 1) batch; results are scattered back to callers.
+    """
+    def __init__(self, model, max_batch=32, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, seq):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((seq, future))
+        return await future
+
+    def _predict(self, seqs):
+        with torch.inference_mode():
+            batch = torch.tensor(seqs, dtype=torch.float32).unsqueeze(-1)
+            return self.model(batch).view(-1).tolist()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            seqs = [seq for seq, _ in items]
+            try:
+                preds = await asyncio.to_thread(self._predict, seqs)
+                for (_, future), pred in zip(items, preds):
+                    if not future.done():
+                        future.set_result(pred)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
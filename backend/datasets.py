@@ -1,10 +1,29 @@
 import os
+import json
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, get_worker_info
 import numpy as np
 import rasterio
 from rasterio.transform import from_origin
-import random
+from concurrent.futures import ThreadPoolExecutor
+from .kernels import ndwi_mask
+
+# NDWI threshold used to derive synthetic water labels from Green/NIR
+WATER_NDWI_THRESHOLD = 0.5
+
+# Largest set SWEDDataset(cached=True) memoizes (the synthetic default is 50)
+MEMO_MAX_SAMPLES = 64
+
+# Tiled + DEFLATE/predictor GeoTIFFs: one 128x128 tile per sample, 2-4x smaller
+GTIFF_PROFILE = dict(
+    tiled=True,
+    blockxsize=128,
+    blockysize=128,
+    compress='deflate',
+    predictor=2,
+    num_threads='all_cpus',
+    BIGTIFF='IF_SAFER',
+)
 
 class SWEDDataset(Dataset):
     """
@@ -13,23 +32,67 @@ class SWEDDataset(Dataset):
     root/
       images/ (GeoTIFFs with bands)
       labels/ (GeoTIFFs with binary mask)
+    If prepare_cache() has been run, samples are sliced from memory-mapped
+    images.npy / labels.npy instead of opening two GeoTIFFs per item
+    (use_npy_cache: True/False if the caller already checked cache_is_current()).
+    Intended for a DataLoader with persistent_workers=True and pin_memory on
+    CUDA, so each worker keeps its GDAL environment open across epochs.
+    With cached=True, decoded (image, label) tensors are kept in memory after
+    their first read, so later epochs skip disk entirely. This applies only to
+    small sets (<= MEMO_MAX_SAMPLES) without a memmap cache.
     """
-    def __init__(self, root_dir, augment=False):
+    def __init__(self, root_dir, augment=False, cached=False, filenames=None, use_npy_cache=None):
         self.root_dir = root_dir
         self.augment = augment
         self.image_dir = os.path.join(root_dir, 'images')
         self.label_dir = os.path.join(root_dir, 'labels')
         
-        # List files
-        if os.path.exists(self.image_dir):
-            self.filenames = [f for f in os.listdir(self.image_dir) if f.endswith('.tif')]
+        # List files (unless the caller already scanned the directory)
+        if filenames is not None:
+            self.filenames = sorted(filenames)
+        elif os.path.exists(self.image_dir):
+            self.filenames = sorted(f for f in os.listdir(self.image_dir) if f.endswith('.tif'))
         else:
             self.filenames = []
 
+        # Per-worker GDAL environment, opened lazily inside the worker process
+        self._gdal_env = None
+
+        # Memory-mapped tile cache (O(1) slicing, no per-item header parsing)
+        self.images = None
+        self.labels = None
+        # Callers that already ran cache_is_current() pass its result to skip
+        # a second stat pass over every tile
+        if use_npy_cache is None:
+            use_npy_cache = cache_is_current(root_dir, self.filenames)
+        if use_npy_cache:
+            img_cache, lbl_cache, _ = _cache_paths(root_dir)
+            self.images = np.load(img_cache, mmap_mode='r')
+            self.labels = np.load(lbl_cache, mmap_mode='r')
+
+        # The memo is per worker and holds float32 tensors (4x the uint8 tiles),
+        # so it only pays off for small sets read from GeoTIFFs; the memmap
+        # already makes repeat reads cheap
+        use_memo = cached and self.images is None and len(self.filenames) <= MEMO_MAX_SAMPLES
+        self._cache = [None] * len(self.filenames) if use_memo else None
+
     def __len__(self):
         return len(self.filenames)
 
     def __getitem__(self, idx):
+        if self._cache is None:
+            return self._load(idx)
+        if self._cache[idx] is None:
+            self._cache[idx] = self._load(idx)
+        return self._cache[idx]
+
+    def _load(self, idx):
+        if self.images is not None:
+            image = np.asarray(self.images[idx], dtype=np.float32) / 255.0
+            label = np.asarray(self.labels[idx], dtype=np.float32)
+            return self._to_tensors(image, label)
+
+        self._ensure_gdal_env()
         img_name = self.filenames[idx]
         img_path = os.path.join(self.image_dir, img_name)
         lbl_path = os.path.join(self.label_dir, img_name)
@@ -46,27 +109,108 @@ class SWEDDataset(Dataset):
                 label = src.read(1) # Shape: (H, W)
                 label = label.astype(np.float32)
 
-            # --- Data Augmentation (Runtime) ---
-            if self.augment:
-                # 1. Horizontal Flip
-                if random.random() > 0.5:
-                    image = np.flip(image, axis=2).copy()
-                    label = np.flip(label, axis=1).copy()
-                
-                # 2. Vertical Flip
-                if random.random() > 0.5:
-                    image = np.flip(image, axis=1).copy()
-                    label = np.flip(label, axis=0).copy()
-
-            # Convert to Tensor
-            image_t = torch.from_numpy(image)
-            label_t = torch.from_numpy(label).unsqueeze(0) # (1, H, W)
-
-            return image_t, label_t
+            return self._to_tensors(image, label)
         except Exception as e:
             print(f"Error loading {img_name}: {e}")
             return torch.zeros(4, 128, 128), torch.zeros(1, 128, 128)
 
+    def _ensure_gdal_env(self):
+        # Persistent workers keep this Env (and its block cache) for their lifetime
+        if self._gdal_env is None and get_worker_info() is not None:
+            self._gdal_env = rasterio.Env(GDAL_CACHEMAX=512, GDAL_NUM_THREADS=2)
+            self._gdal_env.__enter__()
+
+    def _to_tensors(self, image, label):
+        # Augmentation runs batched on-device in the training loop (see augment_batch)
+        image_t = torch.from_numpy(image)
+        label_t = torch.from_numpy(label).unsqueeze(0) # (1, H, W)
+
+        return image_t, label_t
+
+def augment_batch(images, masks):
+    """
+    Random horizontal/vertical flips applied per-sample to a whole batch,
+    on whatever device the tensors live on. Shapes: (B, C, H, W).
+    """
+    # 1. Horizontal Flip
+    flip_h = torch.rand(images.size(0), device=images.device) > 0.5
+    images[flip_h] = torch.flip(images[flip_h], dims=[-1])
+    masks[flip_h] = torch.flip(masks[flip_h], dims=[-1])
+
+    # 2. Vertical Flip
+    flip_v = torch.rand(images.size(0), device=images.device) > 0.5
+    images[flip_v] = torch.flip(images[flip_v], dims=[-2])
+    masks[flip_v] = torch.flip(masks[flip_v], dims=[-2])
+    return images, masks
+
+def _cache_paths(root_dir):
+    return (
+        os.path.join(root_dir, 'images.npy'),
+        os.path.join(root_dir, 'labels.npy'),
+        os.path.join(root_dir, 'cache_filenames.json'),
+    )
+
+def cache_is_current(root_dir, filenames):
+    """
+    True if the .npy cache was built from exactly these tiles (same sorted
+    filename list) and no image or label tile has changed since.
+    """
+    img_cache, lbl_cache, manifest = _cache_paths(root_dir)
+    if not all(os.path.exists(p) for p in (img_cache, lbl_cache, manifest)):
+        return False
+    with open(manifest, 'r') as f:
+        if json.load(f) != sorted(filenames):
+            return False
+
+    built = os.path.getmtime(img_cache)
+    for sub in ('images', 'labels'):
+        for name in filenames:
+            # A tile missing at build time was cached as zeros; it only
+            # invalidates the cache once it appears (newer than images.npy)
+            try:
+                if os.path.getmtime(os.path.join(root_dir, sub, name)) > built:
+                    return False
+            except FileNotFoundError:
+                continue
+    return True
+
+def prepare_cache(root_dir, filenames=None):
+    """
+    One-time conversion of the GeoTIFF tiles into stacked .npy arrays:
+    images.npy (N, 4, 128, 128) uint8 and labels.npy (N, 128, 128) uint8,
+    plus cache_filenames.json recording which tiles (in order) they hold.
+    SWEDDataset memory-maps these instead of reading GeoTIFFs per item.
+    """
+    img_dir = os.path.join(root_dir, 'images')
+    lbl_dir = os.path.join(root_dir, 'labels')
+    if filenames is None:
+        filenames = [f for f in os.listdir(img_dir) if f.endswith('.tif')]
+    filenames = sorted(filenames)
+    img_cache, lbl_cache, manifest = _cache_paths(root_dir)
+
+    # Drop the old manifest first so a half-written cache is never trusted
+    if os.path.exists(manifest):
+        os.remove(manifest)
+
+    images = np.lib.format.open_memmap(img_cache, mode='w+', dtype=np.uint8, shape=(len(filenames), 4, 128, 128))
+    labels = np.lib.format.open_memmap(lbl_cache, mode='w+', dtype=np.uint8, shape=(len(filenames), 128, 128))
+    for i, name in enumerate(filenames):
+        try:
+            with rasterio.open(os.path.join(img_dir, name)) as src:
+                images[i] = src.read([1, 2, 3, 4])
+            with rasterio.open(os.path.join(lbl_dir, name)) as src:
+                labels[i] = src.read(1)
+        except Exception as e:
+            # Same tolerance as a GeoTIFF-backed SWEDDataset: a bad tile becomes zeros
+            print(f"Error loading {name}: {e}")
+            images[i] = 0
+            labels[i] = 0
+    images.flush()
+    labels.flush()
+    with open(manifest, 'w') as f:
+        json.dump(filenames, f)
+    print(f"✅ Cached {len(filenames)} SWED tiles to {img_cache}")
+
 def generate_synthetic_swed(root_dir, num_samples=20):
     """
     Generates synthetic GeoTIFF data mimicking SWED structure.
@@ -81,53 +225,70 @@ def generate_synthetic_swed(root_dir, num_samples=20):
 
     transform = from_origin(0, 0, 10, 10) # Dummy transform
 
-    for i in range(num_samples):
-        # Generate Fake Sentinel-2 Data (4 bands: R, G, B, NIR)
-        # Shape: 128x128
-        data = np.random.randint(0, 255, (4, 128, 128), dtype=np.uint8)
-        
-        # Create a fake "water" feature (circle/blob) in NIR band
-        y, x = np.ogrid[:128, :128]
-        mask = (x - 64)**2 + (y - 64)**2 < 30**2
-        
-        # Set water pixels: Low NIR, High Blue/Green
-        data[3, mask] = 10   # NIR Low
-        data[1, mask] = 200  # Green High
-        data[2, mask] = 220  # Blue High
-
-        # Add some noise for robustness
-        noise = np.random.randint(0, 20, (4, 128, 128), dtype=np.uint8)
-        data = np.clip(data + noise, 0, 255)
-
-        # Create Label
-        label = mask.astype(np.uint8)
-
-        # Write Image
-        with rasterio.open(
-            os.path.join(img_dir, f'sample_{i}.tif'),
-            'w',
-            driver='GTiff',
-            height=128,
-            width=128,
-            count=4,
-            dtype=data.dtype,
-            crs='+proj=latlong',
-            transform=transform,
-        ) as dst:
-            dst.write(data)
-
-        # Write Label
-        with rasterio.open(
-            os.path.join(lbl_dir, f'sample_{i}.tif'),
-            'w',
-            driver='GTiff',
-            height=128,
-            width=128,
-            count=1,
-            dtype=label.dtype,
-            crs='+proj=latlong',
-            transform=transform,
-        ) as dst:
-            dst.write(label, 1)
+    # Place a fake "water" feature (circle/blob), shared by every sample
+    y, x = np.ogrid[:128, :128]
+    mask = (x - 64)**2 + (y - 64)**2 < 30**2
+
+    # Generate Fake Sentinel-2 Data (4 bands: R, G, B, NIR) for all samples at once
+    # Shape: (N, 4, 128, 128)
+    rng = np.random.default_rng()
+    all_data = rng.integers(0, 255, (num_samples, 4, 128, 128), dtype=np.uint8)
+
+    # Land background: Green in [0, 128), NIR in [128, 255). Even with the
+    # noise below NDWI stays under 0.07, so only the water shape crosses the threshold
+    all_data[:, 1] //= 2
+    all_data[:, 3] = all_data[:, 3] // 2 + 128
+
+    # Set water pixels in one broadcast pass over bands 1-3 (Red is untouched):
+    # Green High, Blue High, NIR Low
+    water_values = np.array([200, 220, 10], dtype=np.uint8)[:, None, None]
+    all_data[:, 1:] = np.where(mask, water_values, all_data[:, 1:])
+
+    # Add some noise for robustness
+    noise = rng.integers(0, 20, (num_samples, 4, 128, 128), dtype=np.uint8)
+    all_data = np.clip(all_data.astype(np.uint16) + noise, 0, 255).astype(np.uint8)
+
+    # Create Labels from the bands themselves (Green vs NIR); given the land
+    # background above they coincide with the placed water shape
+    labels = [ndwi_mask(all_data[i, 1], all_data[i, 3], WATER_NDWI_THRESHOLD) for i in range(num_samples)]
+
+    def _write_sample(i, data, label):
+        # rasterio.Env is thread-local, so each worker thread opens its own
+        with rasterio.Env(GDAL_NUM_THREADS='ALL_CPUS'):
+            # Write Image
+            with rasterio.open(
+                os.path.join(img_dir, f'sample_{i}.tif'),
+                'w',
+                driver='GTiff',
+                height=128,
+                width=128,
+                count=4,
+                dtype=data.dtype,
+                crs='+proj=latlong',
+                transform=transform,
+                **GTIFF_PROFILE,
+            ) as dst:
+                dst.write(data)
+
+            # Write Label
+            with rasterio.open(
+                os.path.join(lbl_dir, f'sample_{i}.tif'),
+                'w',
+                driver='GTiff',
+                height=128,
+                width=128,
+                count=1,
+                dtype=label.dtype,
+                crs='+proj=latlong',
+                transform=transform,
+                **GTIFF_PROFILE,
+            ) as dst:
+                dst.write(label, 1)
+
+    # GTiff encoding releases the GIL, so writes overlap across threads
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(_write_sample, i, all_data[i], labels[i]) for i in range(num_samples)]
+        for future in futures:
+            future.result()
 
     print(f"✅ Generated {num_samples} synthetic SWED samples in {root_dir}")
@@ -0,0 +1,22 @@
+import numpy as np
+from numba import njit, prange
+
+# ==========================================
+# Compiled raster kernels (Numba)
+# ==========================================
+@njit(parallel=True, fastmath=True, cache=True)
+def ndwi_mask(b3, b8, thr):
+    """
+    Binary water mask from Green (B3) and NIR (B8) bands of shape (H, W):
+    1 where NDWI = (B3 - B8) / (B3 + B8) > thr, else 0.
+    Fuses the index and threshold into a single pass over the pixels.
+    """
+    out = np.empty(b3.shape, np.uint8)
+    for i in prange(b3.shape[0]):
+        for j in range(b3.shape[1]):
+            # Promote to float so uint8 bands cannot overflow
+            g = np.float32(b3[i, j])
+            n = np.float32(b8[i, j])
+            s = g + n
+            out[i, j] = 1 if (s > 0 and (g - n) / s > thr) else 0
+    return out
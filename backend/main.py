@@ -1,18 +1,24 @@
 import os
+import asyncio
 import contextlib
+import datetime
+import aiofiles
+import cachetools
 from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import json
-import torch
-import numpy as np
 
 # Import engines
 from .satellite_engine import SatelliteEngine
 from .ai_engine import AIEngine
 from .ml_definitions import MLManager
 from .train_init import train_initial_models
+from .spread_store import SpreadStore, SpreadPrecomputer
+from .batching import BatchRunner
+from .create_ppt import create_presentation, PPTX_PATH
 
 # Application Lifecycle Manager
 @contextlib.asynccontextmanager
@@ -26,8 +32,56 @@ async def lifespan(app: FastAPI):
     
     # Attach manager to app state for endpoints to use
     app.state.ml_manager = ml_manager
+
+    # Background worker serving water-spread analyses from the precomputed store
+    app.state.spread_store = SpreadStore()
+    app.state.precomputer = SpreadPrecomputer(sat_engine, app.state.spread_store)
+    app.state.precomputer.start()
+    # Short-lived memo shared by the water-spread and report endpoints
+    app.state.sat_cache = cachetools.TTLCache(maxsize=4096, ttl=300)
+
+    # Coalesces concurrent forecast requests into LSTM batches
+    app.state.forecast_batcher = BatchRunner(ml_manager.lstm)
+    app.state.forecast_batcher.start()
+
+    # RLHF feedback is queued and appended to disk in batches
+    app.state.rlhf_queue = asyncio.Queue()
+    app.state.rlhf_fh = await aiofiles.open("backend/rlhf_logs.jsonl", "a")
+    rlhf_task = asyncio.create_task(_drain_feedback(app.state.rlhf_queue, app.state.rlhf_fh))
+
+    # Build the presentation once, only if it is older than its generator
+    ppt_src = os.path.join(os.path.dirname(__file__), "create_ppt.py")
+    if not os.path.exists(PPTX_PATH) or os.path.getmtime(PPTX_PATH) < os.path.getmtime(ppt_src):
+        await asyncio.to_thread(create_presentation)
     yield
-    # Shutdown logic (if needed)
+    # Shutdown: stop the workers and release pooled HTTP connections
+    rlhf_task.cancel()
+    await asyncio.gather(rlhf_task, return_exceptions=True)
+    await _write_feedback_batch(app.state.rlhf_queue, app.state.rlhf_fh)
+    await app.state.rlhf_fh.close()
+    await app.state.forecast_batcher.stop()
+    await app.state.precomputer.stop()
+    app.state.spread_store.close()
+    await ai_engine.aclose()
+
+async def _write_feedback_batch(queue, fh, batch=None):
+    batch = batch or []
+    while not queue.empty():
+        batch.append(queue.get_nowait())
+    if batch:
+        await fh.write("\n".join(batch) + "\n")
+        await fh.flush()
+
+async def _drain_feedback(queue, fh, interval=0.05):
+    while True:
+        # Block until there is something to write, then flush everything queued
+        first = await queue.get()
+        try:
+            await _write_feedback_batch(queue, fh, [first])
+        except Exception as e:
+            # Keep the writer alive (disk full, permissions); this batch is dropped
+            print(f"RLHF feedback write failed: {e}")
+        await asyncio.sleep(interval)
 
 app = FastAPI(title="HydroAI Backend", lifespan=lifespan)
 
@@ -66,6 +120,29 @@ class FeedbackRequest(BaseModel):
 class ForecastRequest(BaseModel):
     historical_volumes: List[float] # Last 12 months
 
+# --- Helpers ---
+
+async def _cached_spread(lat, lng, date_str, wait=True):
+    """
+    Water-spread lookup shared by both endpoints: TTL memo, then the
+    precomputed store, then (if wait) an inline computation.
+    Returns None on a miss when wait is False.
+    """
+    lat, lng = round(lat, 4), round(lng, 4)
+    key = (lat, lng, date_str)
+    app.state.precomputer.touch(lat, lng, date_str)
+    cache = app.state.sat_cache
+    if key in cache:
+        return cache[key]
+
+    result = app.state.spread_store.get(lat, lng, date_str)
+    if result is None:
+        if not wait:
+            return None
+        result = await app.state.precomputer.compute(lat, lng, date_str)
+    cache[key] = result
+    return result
+
 # --- Routes ---
 
 @app.get("/")
@@ -73,31 +150,37 @@ def health_check():
     return {"status": "HydroAI Backend Online", "ml_status": "Active"}
 
 @app.post("/api/satellite/water-spread")
-def get_water_spread(req: AnalysisRequest):
+async def get_water_spread(req: AnalysisRequest):
     try:
-        # Use ML manager for segmentation if image data available (simulated here)
-        result = sat_engine.analyze_water_spread(
-            lat=req.location.lat, 
-            lng=req.location.lng, 
-            date_str=req.date
-        )
-        return result
+        # Serve from cache/store; GEE runs only in the background worker
+        result = await _cached_spread(req.location.lat, req.location.lng, req.date, wait=False)
+        if result is not None:
+            return result
+
+        # Cold miss (location never analyzed): nothing to serve yet, so block once
+        lat, lng = round(req.location.lat, 4), round(req.location.lng, 4)
+        last_known = app.state.spread_store.get_latest(lat, lng)
+        if last_known is None:
+            return await _cached_spread(lat, lng, req.date)
+
+        # Warm miss: schedule computation and serve the last known value meanwhile
+        app.state.precomputer.enqueue(lat, lng, req.date)
+        return JSONResponse(status_code=202, content={**last_known, "status": "pending"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/ml/forecast")
-def get_ml_forecast(req: ForecastRequest):
+async def get_ml_forecast(req: ForecastRequest):
     """
     Uses the LSTM model to predict next month's volume.
     """
     try:
-        model = app.state.ml_manager.lstm
-        
-        # Prepare input: (1, 12, 1)
-        input_seq = torch.tensor(req.historical_volumes[-12:]).float().view(1, 12, 1)
-        
-        with torch.no_grad():
-            prediction = model(input_seq).item()
+        # Input: last 12 months, batched with concurrent requests as (B, 12, 1)
+        input_seq = req.historical_volumes[-12:]
+        if len(input_seq) != 12:
+            raise ValueError("Forecast requires 12 months of history")
+
+        prediction = await app.state.forecast_batcher.submit(input_seq)
             
         return {
             "predicted_volume": max(0, prediction), # No negative volume
@@ -113,13 +196,8 @@ def check_anomaly(req: AnalysisRequest):
     Uses Isolation Forest to check if current volume is anomalous.
     """
     try:
-        model = app.state.ml_manager.iso_forest
-        
-        # Reshape for sklearn (1, -1)
-        # Using volume as the feature
-        score = model.predict([[req.current_volume]])
-        
-        is_anomaly = score[0] == -1
+        # Interval lookup precomputed from the Isolation Forest at load time
+        is_anomaly = app.state.ml_manager.is_anomalous(req.current_volume)
         return {"is_anomaly": bool(is_anomaly), "model": "Isolation Forest"}
     except Exception as e:
         return {"is_anomaly": False, "error": str(e)}
@@ -139,22 +217,22 @@ async def trigger_retraining(background_tasks: BackgroundTasks):
     """
     Triggers model retraining in the background.
     """
-    background_tasks.add_task(train_initial_models, is_retraining=True)
+    # Only the U-Net depends on SWED data; the other models are left as they are.
+    # An explicit retrain always runs, even if no tile changed since the last fit
+    background_tasks.add_task(train_initial_models, is_retraining=True, stages=('unet',), force=True)
     return {"status": "Retraining started", "message": "Check metrics endpoint for updates."}
 
 @app.post("/api/ai/generate-report")
-def generate_report(req: AnalysisRequest):
+async def generate_report(req: AnalysisRequest):
     try:
         # 1. Get Satellite Data
-        sat_data = sat_engine.analyze_water_spread(
-            req.location.lat, req.location.lng, req.date
-        )
-        
-        # 2. Check Anomaly
-        ml_anomaly = app.state.ml_manager.iso_forest.predict([[req.current_volume]])[0] == -1
+        sat_data = await _cached_spread(req.location.lat, req.location.lng, req.date)
+
+        # 2. Check Anomaly (precomputed interval lookup, no thread hop needed)
+        ml_anomaly = app.state.ml_manager.is_anomalous(req.current_volume)
 
         # 3. Pass combined data to Gemini
-        report = ai_engine.generate_hydrologist_report(
+        report = await ai_engine.generate_hydrologist_report(
             reservoir_name=req.reservoir_name,
             stats={
                 "volume": req.current_volume,
@@ -171,15 +249,25 @@ def generate_report(req: AnalysisRequest):
         print(f"AI Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/ppt")
+def get_ppt():
+    """
+    Serves the pre-built Mapathon presentation (generated at startup).
+    """
+    return FileResponse(
+        PPTX_PATH,
+        media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        filename=os.path.basename(PPTX_PATH)
+    )
+
 @app.post("/api/feedback")
-def submit_rlhf_feedback(feedback: FeedbackRequest):
-    # Log feedback for retraining
+async def submit_rlhf_feedback(feedback: FeedbackRequest):
+    # Log feedback for retraining (written to disk by the background drainer)
     entry = {
         "reservoir": feedback.reservoir_name,
         "original": feedback.original_risk,
         "corrected": feedback.corrected_risk,
-        "timestamp": "2024-01-29T12:00:00Z"
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
     }
-    with open("backend/rlhf_logs.jsonl", "a") as f:
-        f.write(json.dumps(entry) + "\n")
-    return {"status": "success"}
+    await app.state.rlhf_queue.put(json.dumps(entry))
+    return {"status": "queued"}
@@ -1,5 +1,7 @@
+import copy
 import torch
 import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier, IsolationForest
 import joblib
@@ -9,17 +11,19 @@ import json
 # ==========================================
 # Helper: IoU Metric Calculation
 # ==========================================
-def calculate_iou(pred, target, threshold=0.5):
+def batch_iou_sum(pred, target, threshold=0.5):
     """
-    Calculates Intersection over Union for binary segmentation.
+    Sum of per-sample IoUs over a (N, 1, H, W) batch, as a 0-dim tensor.
+    One fused reduction per batch; divide by the sample count for the mean.
     """
-    pred_bin = (pred > threshold).float()
-    intersection = (pred_bin * target).sum()
-    union = pred_bin.sum() + target.sum() - intersection
+    pred_bin = pred > threshold
+    target_bin = target.bool()
+    intersection = (pred_bin & target_bin).sum(dim=(1, 2, 3))
+    union = (pred_bin | target_bin).sum(dim=(1, 2, 3))
     
-    if union == 0:
-        return 1.0
-    return intersection / union
+    # Empty prediction and target counts as a perfect match
+    iou = torch.where(union == 0, torch.ones_like(union, dtype=torch.float32), intersection.float() / union.clamp_min(1))
+    return iou.sum()
 
 # ==========================================
 # 1. U-Net for Water Segmentation (Deep Learning)
@@ -39,11 +43,22 @@ class DoubleConv(nn.Module):
     def forward(self, x):
         return self.conv(x)
 
+    def fuse(self):
+        """
+        Folds each BatchNorm into the preceding Conv2d (inference only).
+        Conv->BN->ReLU x2 becomes Conv->ReLU x2.
+        """
+        conv1, bn1, relu1, conv2, bn2, relu2 = self.conv
+        self.conv = nn.Sequential(
+            fuse_conv_bn_eval(conv1, bn1), relu1,
+            fuse_conv_bn_eval(conv2, bn2), relu2
+        )
+
 class WaterUNet(nn.Module):
     """
     U-Net adapted for Sentinel-2 Inputs.
     Input: 4 Channels (Red, Green, Blue, NIR)
-    Output: 1 Channel (Probability of Water)
+    Output: 1 Channel (Water logits; apply sigmoid for probability)
     """
     def __init__(self, n_channels=4, n_classes=1):
         super(WaterUNet, self).__init__()
@@ -55,7 +70,6 @@ class WaterUNet(nn.Module):
         self.up2 = nn.ConvTranspose2d(64, 32, 2, stride=2)
         self.up_conv2 = DoubleConv(64, 32)
         self.outc = nn.Conv2d(32, n_classes, 1)
-        self.sigmoid = nn.Sigmoid()
 
     def forward(self, x):
         x1 = self.inc(x)
@@ -71,7 +85,7 @@ class WaterUNet(nn.Module):
         x = self.up_conv2(x)
         
         logits = self.outc(x)
-        return self.sigmoid(logits)
+        return logits
 
 # ==========================================
 # 2. LSTM for Seasonal Forecasting (Time Series)
@@ -85,51 +99,176 @@ class ReservoirLSTM(nn.Module):
         self.fc = nn.Linear(hidden_size, output_size)
 
     def forward(self, x):
-        h0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(x.device)
-        c0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(x.device)
-        out, _ = self.lstm(x, (h0, c0))
+        # nn.LSTM defaults h0/c0 to zeros when no hidden state is passed
+        out, _ = self.lstm(x)
         out = self.fc(out[:, -1, :])
         return out
 
 # ==========================================
 # 3. Model Manager (Loader/Saver)
 # ==========================================
+# Saved model file per training stage
+MODEL_FILES = {
+    "unet": "unet_swed.pth",
+    "lstm": "lstm_forecast.pth",
+    "iso": "iso_forest.joblib",
+    "rf": "risk_rf.joblib"
+}
+
 class MLManager:
     def __init__(self, model_dir="backend/models"):
         self.model_dir = model_dir
         os.makedirs(self.model_dir, exist_ok=True)
         self.metrics_file = os.path.join(model_dir, "training_metrics.json")
+        # Per-epoch NDJSON log, appended while training runs
+        self.metrics_log_file = os.path.join(model_dir, "training_metrics.ndjson")
         
         # Initialize with 4 channels for Sentinel-2 (R,G,B,NIR)
         self.unet = WaterUNet(n_channels=4) 
         self.lstm = ReservoirLSTM()
-        self.iso_forest = IsolationForest(contamination=0.1)
-        self.risk_rf = RandomForestClassifier(n_estimators=100)
+        # n_jobs=-1 builds trees on threads across all cores; max_samples bounds
+        # per-tree work (capped to the data size at fit time)
+        self.iso_forest = IsolationForest(n_estimators=100, max_samples=256, bootstrap=False, contamination=0.1, n_jobs=-1)
+        self.risk_rf = RandomForestClassifier(n_estimators=100, n_jobs=-1)
+        # Normal-volume interval [lo, hi] of the Isolation Forest (see _compute_anomaly_bounds)
+        self.anomaly_bounds = None
         
-    def save_models(self):
-        torch.save(self.unet.state_dict(), f"{self.model_dir}/unet_swed.pth")
-        torch.save(self.lstm.state_dict(), f"{self.model_dir}/lstm_forecast.pth")
-        joblib.dump(self.iso_forest, f"{self.model_dir}/iso_forest.joblib")
-        joblib.dump(self.risk_rf, f"{self.model_dir}/risk_rf.joblib")
+    def save_models(self, stages=MODEL_FILES):
+        if 'unet' in stages:
+            torch.save(self.unet.state_dict(), f"{self.model_dir}/{MODEL_FILES['unet']}")
+        if 'lstm' in stages:
+            torch.save(self.lstm.state_dict(), f"{self.model_dir}/{MODEL_FILES['lstm']}")
+        if 'iso' in stages:
+            joblib.dump(self.iso_forest, f"{self.model_dir}/{MODEL_FILES['iso']}")
+        if 'rf' in stages:
+            joblib.dump(self.risk_rf, f"{self.model_dir}/{MODEL_FILES['rf']}")
         print("✅ Models saved to disk.")
 
+    def needs_retrain(self, stage, data_path=None):
+        """
+        True if the stage's saved model is missing, or older than its training
+        data (the newest tile under data_path's images/ or labels/). Only the
+        U-Net trains on on-disk data (SWED); the other stages use synthetic
+        inputs, so an existing model file is never stale.
+        """
+        model_path = os.path.join(self.model_dir, MODEL_FILES[stage])
+        if not os.path.exists(model_path):
+            return True
+        if stage == 'unet' and data_path:
+            newest = max(self._newest_mtime(os.path.join(data_path, sub)) for sub in ('images', 'labels'))
+            return newest > os.path.getmtime(model_path)
+        return False
+
+    @staticmethod
+    def _newest_mtime(data_dir):
+        # A directory's own mtime only moves when entries are added or removed,
+        # so overwritten tiles are caught by checking every file in it
+        try:
+            with os.scandir(data_dir) as entries:
+                mtimes = [e.stat().st_mtime for e in entries if e.is_file()]
+        except FileNotFoundError:
+            return 0.0
+        return max(mtimes, default=os.path.getmtime(data_dir))
+
     def load_models(self):
+        # Load into fresh instances so a failed or repeated call never touches
+        # the already-traced/scripted models; assign only once every file loaded
         try:
-            self.unet.load_state_dict(torch.load(f"{self.model_dir}/unet_swed.pth"))
-            self.unet.eval()
+            unet = WaterUNet(n_channels=4)
+            unet.load_state_dict(torch.load(f"{self.model_dir}/unet_swed.pth", map_location="cpu"))
+            unet.eval()
             
-            self.lstm.load_state_dict(torch.load(f"{self.model_dir}/lstm_forecast.pth"))
-            self.lstm.eval()
+            lstm = ReservoirLSTM()
+            lstm.load_state_dict(torch.load(f"{self.model_dir}/lstm_forecast.pth", map_location="cpu"))
+            lstm.eval()
+            lstm.lstm.flatten_parameters()
             
-            self.iso_forest = joblib.load(f"{self.model_dir}/iso_forest.joblib")
-            self.risk_rf = joblib.load(f"{self.model_dir}/risk_rf.joblib")
-            print("✅ Models loaded from disk.")
-            return True
+            iso_forest = joblib.load(f"{self.model_dir}/iso_forest.joblib")
+            risk_rf = joblib.load(f"{self.model_dir}/risk_rf.joblib")
         except FileNotFoundError:
             print("⚠️ Models not found. Training initialization required.")
             return False
 
+        self.unet_device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.unet_dtype = torch.float16 if self.unet_device.type == 'cuda' else torch.float32
+        self.unet = self._prepare_unet_inference(unet, self.unet_device, self.unet_dtype)
+        self.lstm = torch.jit.script(lstm)
+        self.iso_forest = iso_forest
+        self._compute_anomaly_bounds()
+        self.risk_rf = risk_rf
+        print("✅ Models loaded from disk.")
+        return True
+
+    def _compute_anomaly_bounds(self, grid_max=200.0, grid_size=10000):
+        """
+        The Isolation Forest sees a single feature (volume), so its decision
+        boundary can be sampled once and replaced by an interval check.
+        Left as None if the normal region is not one contiguous interval.
+        """
+        self.anomaly_bounds = None
+        if getattr(self.iso_forest, "n_features_in_", None) != 1:
+            return
+        xs = np.linspace(0, grid_max, grid_size)
+        normal = self.iso_forest.predict(xs.reshape(-1, 1)) == 1
+        idx = np.flatnonzero(normal)
+        if len(idx) == 0 or idx[-1] - idx[0] + 1 != len(idx):
+            return
+        # Only trust interval edges that lie strictly inside the sampled grid
+        if idx[0] == 0 or idx[-1] == grid_size - 1:
+            return
+        self.anomaly_bounds = (xs[idx[0]], xs[idx[-1]], grid_max)
+
+    def is_anomalous(self, volume):
+        """
+        True if the Isolation Forest flags this volume as an anomaly.
+        """
+        if self.anomaly_bounds is not None:
+            lo, hi, grid_max = self.anomaly_bounds
+            if 0 <= volume <= grid_max:
+                return not (lo <= volume <= hi)
+        return bool(self.iso_forest.predict([[volume]])[0] == -1)
+
+    def _prepare_unet_inference(self, unet, device, dtype):
+        """
+        Returns a traced copy of the U-Net for serving (the input is left
+        untouched): BatchNorm folded into the convs, channels_last layout,
+        cast to `dtype` on `device` (FP16 on CUDA for tensor cores, else FP32).
+        """
+        torch.set_float32_matmul_precision('high')
+
+        # Fuse a copy so the caller's module keeps its BatchNorm layers
+        model = copy.deepcopy(unet).eval()
+        for module in list(model.modules()):
+            if isinstance(module, DoubleConv):
+                module.fuse()
+
+        model = model.to(device, dtype=dtype, memory_format=torch.channels_last)
+        example = torch.randn(1, 4, 128, 128, device=device, dtype=dtype)
+        with torch.no_grad():
+            return torch.jit.trace(model, example.to(memory_format=torch.channels_last))
+
+    def segment(self, images):
+        """
+        Water probability mask for a (B, 4, H, W) batch, returned as FP32 on CPU.
+        Runs the traced serving U-Net from load_models().
+        """
+        with torch.inference_mode():
+            x = images.to(self.unet_device, dtype=self.unet_dtype, memory_format=torch.channels_last)
+            return torch.sigmoid(self.unet(x)).float().cpu()
+
+    def read_metrics_log(self):
+        """
+        Epoch history from the NDJSON log (partial while training is running).
+        """
+        if not os.path.exists(self.metrics_log_file):
+            return []
+        with open(self.metrics_log_file, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
     def get_metrics(self):
+        # The NDJSON log is current even mid-run; the JSON file is the final snapshot
+        if os.path.exists(self.metrics_log_file):
+            return {"history": self.read_metrics_log()}
         if os.path.exists(self.metrics_file):
             with open(self.metrics_file, 'r') as f:
                 return json.load(f)
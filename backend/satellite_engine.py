@@ -1,4 +1,5 @@
 import ee
+import asyncio
 import math
 import random
 import datetime
@@ -9,23 +10,25 @@ class SatelliteEngine:
     def __init__(self):
         self.is_gee_active = False
         try:
-            ee.Initialize()
+            # High-volume endpoint is intended for automated, request-driven traffic
+            ee.Initialize(opt_url='https://earthengine-highvolume.googleapis.com')
+            ee.data.setWorkloadTag("hydroai")
             self.is_gee_active = True
             print("✅ Google Earth Engine Initialized Successfully")
         except Exception as e:
             print("⚠️ GEE Authentication failed. Using High-Fidelity Simulator.")
             self.is_gee_active = False
 
-    def analyze_water_spread(self, lat: float, lng: float, date_str: str):
+    async def analyze_water_spread(self, lat: float, lng: float, date_str: str):
         """
         Main entry point for analysis.
         """
         if self.is_gee_active:
-            return self._fetch_real_gee_data(lat, lng, date_str)
+            return await self._fetch_real_gee_data(lat, lng, date_str)
         else:
             return self._simulate_satellite_pass(lat, lng, date_str)
 
-    def _fetch_real_gee_data(self, lat, lng, date_str):
+    async def _fetch_real_gee_data(self, lat, lng, date_str):
         point = ee.Geometry.Point([lng, lat])
         roi = point.buffer(5000)
 
@@ -43,18 +46,23 @@ class SatelliteEngine:
         if not s2:
              return self._simulate_satellite_pass(lat, lng, date_str)
 
-        ndwi = s2.normalizedDifference(['B3', 'B8']).rename('NDWI')
-        water_mask = ndwi.gt(0.0)
+        # MNDWI (Green/SWIR) suppresses built-up false positives of Green/NIR NDWI
+        ndwi = s2.normalizedDifference(['B3', 'B11']).rename('MNDWI')
+        water_mask = ndwi.gt(0.1)
         
         area_image = water_mask.multiply(ee.Image.pixelArea())
+        # B11 is 20 m native; tileScale splits the reduction across more GEE workers
         stats = area_image.reduceRegion(
-            reducer=ee.Reducer.sum(),
+            reducer=ee.Reducer.sum().unweighted(),
             geometry=roi,
-            scale=10,
-            maxPixels=1e9
+            scale=20,
+            maxPixels=1e9,
+            tileScale=4,
+            bestEffort=True
         )
         
-        water_area_sqm = stats.get('NDWI').getInfo()
+        # getInfo() is a blocking HTTP round-trip; keep it off the event loop
+        water_area_sqm = await asyncio.to_thread(stats.get('MNDWI').getInfo)
         water_area_sqkm = water_area_sqm / 1e6 if water_area_sqm else 0
 
         # Note: In a real production app, we would fetch pixels here for U-Net refinement
@@ -0,0 +1,133 @@
+import os
+import json
+import sqlite3
+import asyncio
+import datetime
+from collections import OrderedDict
+
+class SpreadStore:
+    """
+    SQLite-backed store of precomputed water-spread analyses.
+    Rows are keyed "lat:lng:date" so the API can serve them without touching GEE.
+    """
+    def __init__(self, db_path="backend/data/water_spread.sqlite3"):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS water_spread ("
+            " key TEXT PRIMARY KEY, lat REAL, lng REAL, date TEXT,"
+            " result TEXT, updated_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(lat, lng, date_str):
+        return f"{lat}:{lng}:{date_str}"
+
+    def get(self, lat, lng, date_str):
+        row = self.conn.execute(
+            "SELECT result FROM water_spread WHERE key = ?",
+            (self.make_key(lat, lng, date_str),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_latest(self, lat, lng):
+        """
+        Last known analysis for a location, regardless of date.
+        """
+        row = self.conn.execute(
+            "SELECT result FROM water_spread WHERE lat = ? AND lng = ?"
+            " ORDER BY updated_at DESC LIMIT 1",
+            (lat, lng)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, lat, lng, date_str, result):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO water_spread (key, lat, lng, date, result, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            (self.make_key(lat, lng, date_str), lat, lng, date_str, json.dumps(result))
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class SpreadPrecomputer:
+    """
+    Background worker that keeps the SpreadStore warm.
+    Misses are queued and computed off the request path; the `max_recent`
+    most recently requested (lat, lng, date) keys are recomputed on a fixed
+    interval, except past dates, whose imagery window is already closed.
+    """
+    def __init__(self, sat_engine, store, interval=3600, max_recent=256):
+        self.sat_engine = sat_engine
+        self.store = store
+        self.interval = interval
+        self.max_recent = max_recent
+        self.queue = asyncio.Queue()
+        self._pending = set()
+        self._inflight = {}
+        self._recent = OrderedDict()
+        self._tasks = []
+
+    def touch(self, lat, lng, date_str):
+        """
+        Records a request for this key (LRU, capped at max_recent).
+        """
+        key = (lat, lng, date_str)
+        self._recent[key] = None
+        self._recent.move_to_end(key)
+        if len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+
+    async def compute(self, lat, lng, date_str):
+        # Concurrent callers for the same key share one GEE computation
+        key = SpreadStore.make_key(lat, lng, date_str)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(lat, lng, date_str))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _compute(self, lat, lng, date_str):
+        result = await self.sat_engine.analyze_water_spread(lat, lng, date_str)
+        self.store.put(lat, lng, date_str, result)
+        return result
+
+    def enqueue(self, lat, lng, date_str):
+        key = SpreadStore.make_key(lat, lng, date_str)
+        if key not in self._pending:
+            self._pending.add(key)
+            self.queue.put_nowait((lat, lng, date_str))
+
+    async def _drain(self):
+        while True:
+            lat, lng, date_str = await self.queue.get()
+            try:
+                await self.compute(lat, lng, date_str)
+            except Exception as e:
+                print(f"Water-spread precompute failed for {lat},{lng} {date_str}: {e}")
+            finally:
+                self._pending.discard(SpreadStore.make_key(lat, lng, date_str))
+                self.queue.task_done()
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            today = datetime.date.today().isoformat()
+            for key in list(self._recent):
+                lat, lng, date_str = key
+                if date_str < today:
+                    del self._recent[key]
+                    continue
+                self.enqueue(lat, lng, date_str)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._drain()), asyncio.create_task(self._refresh())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
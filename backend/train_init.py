@@ -1,112 +1,309 @@
 import os
 import json
+import contextlib
 import numpy as np
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import torch
 import torch.optim as optim
 import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.data import DataLoader
-from .ml_definitions import MLManager, calculate_iou
-from .datasets import SWEDDataset, generate_synthetic_swed
+from torch.utils.data.distributed import DistributedSampler
+from .ml_definitions import MLManager, batch_iou_sum
+from .datasets import SWEDDataset, generate_synthetic_swed, prepare_cache, cache_is_current, augment_batch
 
 # Parameters
 BATCH_SIZE = 4
 EPOCHS = 10 
 LR = 0.001
+# Micro-batches per optimizer step: effective batch = BATCH_SIZE * ACCUM_STEPS
+ACCUM_STEPS = 4
 DATA_PATH = "backend/data/swed"
+# Up to 4 workers (half the cores): leaves headroom for the main process driving the GPU
+NUM_WORKERS = min(4, (os.cpu_count() or 0) // 2)
+# Trainable stages: U-Net (SWED), LSTM, Isolation Forest, Random Forest
+STAGES = ('unet', 'lstm', 'iso', 'rf')
 
-def train_initial_models(is_retraining=False):
+def _dumps(obj):
+    # orjson's C serializer when installed, stdlib json otherwise
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+def _make_adam(params, device):
+    # Fused single-kernel update on CUDA; multi-tensor (foreach) path elsewhere
+    if device.type == 'cuda':
+        return optim.Adam(params, lr=LR, fused=True)
+    return optim.Adam(params, lr=LR, foreach=True)
+
+def _seed_worker(worker_id):
+    # Derive numpy's seed from torch's per-worker seed so workers don't share RNG state
+    np.random.seed(torch.initial_seed() % 2**32)
+
+def train_initial_models(is_retraining=False, stages=None, force=False):
     """
     Initializes or Retrains models using SWED dataset.
+    stages: subset of STAGES to consider (default: $HYDROAI_STAGES, else all).
+    A stage runs only if its saved model is missing or stale (see
+    MLManager.needs_retrain), so unchanged models are not refit;
+    force=True trains every requested stage regardless.
+    With more than one GPU, the U-Net trains with DistributedDataParallel
+    (one process per GPU); otherwise a single process trains everything.
     """
     status_msg = "🔄 Retraining..." if is_retraining else "🚀 Initializing..."
     print(f"{status_msg} HydroAI ML Pipeline")
-    
-    manager = MLManager()
-    metrics = {"history": []}
+
+    if stages is None:
+        stages = os.environ.get('HYDROAI_STAGES', ','.join(STAGES)).split(',')
+    stages = {s.strip() for s in stages if s.strip()}
+    unknown = stages - set(STAGES)
+    if unknown:
+        raise ValueError(
+            f"Unknown training stage(s): {', '.join(sorted(unknown))}. "
+            f"Valid stages: {', '.join(STAGES)}"
+        )
+
+    if not force:
+        manager = MLManager()
+        stages = {s for s in stages if manager.needs_retrain(s, data_path=DATA_PATH)}
+    if not stages:
+        print("✅ All requested models are up to date. Nothing to train.")
+        return
     
     # ---------------------------
-    # 1. Prepare Data (SWED) with Augmentation
+    # 1. Prepare Data (SWED) once, before any workers start
     # ---------------------------
-    if not os.path.exists(os.path.join(DATA_PATH, 'images')):
-        generate_synthetic_swed(DATA_PATH, num_samples=50) # More samples for retraining
+    filenames = None
+    if 'unet' in stages:
+        filenames = _scan_swed_images()
+        if not filenames:
+            generate_synthetic_swed(DATA_PATH, num_samples=50) # More samples for retraining
+            filenames = _scan_swed_images()
+            prepare_cache(DATA_PATH, filenames)
+        elif not cache_is_current(DATA_PATH, filenames):
+            prepare_cache(DATA_PATH, filenames)
+
+    world_size = torch.cuda.device_count()
+    if 'unet' in stages and world_size > 1:
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        os.environ.setdefault("MASTER_PORT", "29500")
+        mp.spawn(_train_worker, args=(world_size, filenames, stages), nprocs=world_size, join=True)
+    else:
+        _train_worker(0, 1, filenames, stages)
+
+def _scan_swed_images():
+    # One scandir pass both checks the directory and lists the tiles
+    try:
+        with os.scandir(os.path.join(DATA_PATH, 'images')) as entries:
+            return [e.name for e in entries if e.name.endswith('.tif') and e.is_file()]
+    except FileNotFoundError:
+        return []
+
+def _train_worker(rank, world_size, filenames, stages):
+    """
+    Trains the requested stages on one device. Under DDP (world_size > 1)
+    every rank trains the U-Net on its shard; rank 0 alone trains the small
+    models, writes metrics and saves.
+    """
+    distributed = world_size > 1
+    if distributed:
+        dist.init_process_group('nccl', rank=rank, world_size=world_size)
+        torch.cuda.set_device(rank)
+        device = torch.device('cuda', rank)
+    else:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    is_main = rank == 0
+    # PCG64 generator (no global-state lock), seeded for reproducible retraining
+    rng = np.random.default_rng(seed=0)
+
+    manager = MLManager()
+    # TF32 tensor cores for FP32 matmuls/convs on Ampere+ (no-op elsewhere)
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    # SWED batches have a fixed shape, so cuDNN can autotune conv algorithms once
+    torch.backends.cudnn.benchmark = True
     
-    # Use Augmentation during training
-    dataset = SWEDDataset(DATA_PATH, augment=True)
-    loader = DataLoader(dataset, batch_size=BATCH_SIZE, shuffle=True)
+    if 'unet' in stages:
+        # Each epoch is appended as one NDJSON line (line-buffered: survives a killed run)
+        metrics_fp = open(manager.metrics_log_file, 'w', buffering=1) if is_main else None
+
+        # Use Augmentation during training (applied per batch on-device);
+        # small GeoTIFF-backed sets stay in memory after the first epoch
+        # train_initial_models() has already built or validated the .npy cache
+        dataset = SWEDDataset(DATA_PATH, augment=True, cached=True, filenames=filenames, use_npy_cache=True)
+        sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True) if distributed else None
+        # Inductor-fused forward on CUDA only; eager elsewhere
+        use_compile = hasattr(torch, 'compile') and device.type == 'cuda'
+        loader = DataLoader(
+            dataset,
+            batch_size=BATCH_SIZE,
+            shuffle=sampler is None,
+            sampler=sampler,
+            num_workers=NUM_WORKERS,
+            # Pinned host buffers let the non_blocking H2D copies below overlap compute
+            pin_memory=device.type == 'cuda',
+            # Keep workers (and their GDAL environments) alive across epochs
+            persistent_workers=NUM_WORKERS > 0,
+            worker_init_fn=_seed_worker,
+            prefetch_factor=4 if NUM_WORKERS > 0 else None,
+            # Compiled: keep every batch the same shape so the U-Net never recompiles
+            # (unless that would leave a rank with no batches at all)
+            drop_last=use_compile and len(dataset) // world_size >= BATCH_SIZE
+        )
     
-    # ---------------------------
-    # 2. Train U-Net (Water Segmentation)
-    # ---------------------------
-    print(f"🌊 Training U-Net on SWED ({len(dataset)} samples)...")
-    optimizer = optim.Adam(manager.unet.parameters(), lr=LR)
-    criterion = nn.BCELoss()
+        # ---------------------------
+        # 2. Train U-Net (Water Segmentation)
+        # ---------------------------
+        if is_main:
+            print(f"🌊 Training U-Net on SWED ({len(dataset)} samples, {world_size} device(s))...")
+        # U-Net outputs logits; BCEWithLogitsLoss is autocast-safe (BCELoss is not)
+        criterion = nn.BCEWithLogitsLoss()
+
+        # Mixed precision on CUDA: bf16 where supported, else fp16 with loss scaling
+        use_amp = device.type == 'cuda'
+        amp_dtype = torch.bfloat16 if use_amp and torch.cuda.is_bf16_supported() else torch.float16
+        scaler = torch.cuda.amp.GradScaler(enabled=use_amp and amp_dtype == torch.float16)
     
-    manager.unet.train()
+        # NHWC on CUDA engages tensor-core conv kernels (masks stay NCHW)
+        memory_format = torch.channels_last if device.type == 'cuda' else torch.contiguous_format
+        manager.unet.to(device, memory_format=memory_format)
+        manager.unet.train()
+        # Created after the move: fused Adam requires the parameters on CUDA
+        optimizer = _make_adam(manager.unet.parameters(), device)
+
+        # DDP wrapper + Inductor-fused forward for the fixed SWED shape; manager.unet
+        # still owns the parameters used by the optimizer and save_models()
+        ddp_unet = DDP(manager.unet, device_ids=[rank]) if distributed else None
+        unet = ddp_unet if distributed else manager.unet
+        if use_compile:
+            # Compilation is lazy: backend failures (no Triton, unsupported GPU,
+            # no C++ toolchain) surface on the first forward, so let Dynamo fall
+            # back to eager there instead of aborting training
+            torch._dynamo.config.suppress_errors = True
+            try:
+                unet = torch.compile(unet, dynamic=False)
+            except Exception as e:
+                print(f"⚠️ torch.compile unavailable ({e}); using eager mode.")
     
-    for epoch in range(EPOCHS):
-        epoch_loss = 0
-        epoch_iou = 0
+        for epoch in range(EPOCHS):
+            if sampler is not None:
+                sampler.set_epoch(epoch)
+            # Accumulate on-device; a single .item() per epoch avoids per-batch syncs
+            epoch_loss = torch.zeros((), device=device)
+            epoch_iou_sum = torch.zeros((), device=device)
+            n_samples = torch.zeros((), device=device)
         
-        for images, masks in loader:
-            optimizer.zero_grad()
-            outputs = manager.unet(images)
-            loss = criterion(outputs, masks)
-            loss.backward()
-            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            for batch_idx, (images, masks) in enumerate(loader):
+                images = images.to(device, non_blocking=True, memory_format=memory_format)
+                masks = masks.to(device, non_blocking=True)
+                if dataset.augment:
+                    images, masks = augment_batch(images, masks)
+
+                # Step on every ACCUM_STEPS-th micro-batch (and the epoch's last one);
+                # DDP skips the gradient all-reduce in between
+                is_step = (batch_idx + 1) % ACCUM_STEPS == 0 or batch_idx + 1 == len(loader)
+                # The epoch's last group may hold fewer than ACCUM_STEPS micro-batches
+                group_size = min(ACCUM_STEPS, len(loader) - (batch_idx - batch_idx % ACCUM_STEPS))
+                sync_ctx = ddp_unet.no_sync() if ddp_unet is not None and not is_step else contextlib.nullcontext()
+                with sync_ctx:
+                    with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=use_amp):
+                        outputs = unet(images)
+                        loss = criterion(outputs, masks)
+                    scaler.scale(loss / group_size).backward()
+                if is_step:
+                    scaler.step(optimizer)
+                    scaler.update()
+                    optimizer.zero_grad(set_to_none=True)
             
-            # Metrics
-            epoch_loss += loss.item()
-            with torch.no_grad():
-                epoch_iou += calculate_iou(outputs, masks).item()
+                # Metrics
+                with torch.no_grad():
+                    epoch_loss += loss.detach().float()
+                    # sigmoid(x) > 0.5 exactly when x > 0, so threshold the logits directly
+                    epoch_iou_sum += batch_iou_sum(outputs.detach(), masks, threshold=0.0)
+                    n_samples += images.size(0)
                 
-        avg_loss = epoch_loss / len(loader)
-        avg_iou = epoch_iou / len(loader)
+            if distributed:
+                # Average over all ranks' shards
+                dist.all_reduce(epoch_loss)
+                dist.all_reduce(epoch_iou_sum)
+                dist.all_reduce(n_samples)
+            avg_loss = (epoch_loss / (len(loader) * world_size)).item()
+            avg_iou = (epoch_iou_sum / n_samples).item()
+            if not is_main:
+                continue
         
-        print(f"   Epoch {epoch+1}/{EPOCHS} | Loss: {avg_loss:.4f} | IoU: {avg_iou:.4f}")
+            print(f"   Epoch {epoch+1}/{EPOCHS} | Loss: {avg_loss:.4f} | IoU: {avg_iou:.4f}")
         
-        metrics["history"].append({
-            "epoch": epoch + 1,
-            "loss": round(avg_loss, 4),
-            "iou": round(avg_iou, 4)
-        })
+            metrics_fp.write(_dumps({
+                "epoch": epoch + 1,
+                "loss": round(avg_loss, 4),
+                "iou": round(avg_iou, 4)
+            }) + "\n")
+
+        if distributed:
+            dist.destroy_process_group()
+            if not is_main:
+                return
 
-    # Save metrics to disk for Frontend
-    with open(manager.metrics_file, 'w') as f:
-        json.dump(metrics, f)
+        # Save aggregated metrics to disk for Frontend (built from the NDJSON log)
+        metrics_fp.close()
+        with open(manager.metrics_file, 'w') as f:
+            json.dump({"history": manager.read_metrics_log()}, f)
 
     # ---------------------------
     # 3. Train LSTM (Forecasting)
     # ---------------------------
-    print("📈 Training LSTM on historical time-series...")
-    X_ts = torch.randn(100, 12, 1) 
-    y_ts = torch.randn(100, 1)
+    if 'lstm' in stages:
+        print("📈 Training LSTM on historical time-series...")
+        # Built once, directly on the training device; minibatches are index views
+        X_ts = torch.randn(100, 12, 1, device=device, dtype=torch.float32)
+        y_ts = torch.randn(100, 1, device=device, dtype=torch.float32)
     
-    optimizer = optim.Adam(manager.lstm.parameters(), lr=LR)
-    criterion = nn.MSELoss()
+        manager.lstm.to(device)
+        optimizer = _make_adam(manager.lstm.parameters(), device)
+        criterion = nn.MSELoss()
+        # bf16 autocast needs no loss scaling; skipped where bf16 is unsupported
+        lstm_amp = device.type == 'cuda' and torch.cuda.is_bf16_supported()
     
-    manager.lstm.train()
-    for epoch in range(5):
-        optimizer.zero_grad()
-        output = manager.lstm(X_ts)
-        loss = criterion(output, y_ts)
-        loss.backward()
-        optimizer.step()
+        manager.lstm.train()
+        for epoch in range(5):
+            # Shuffled minibatches; ReservoirLSTM wraps nn.LSTM, so CUDA runs use cuDNN's fused RNN
+            for idx in torch.randperm(len(X_ts), device=device).split(32):
+                xb, yb = X_ts[idx], y_ts[idx]
+                optimizer.zero_grad(set_to_none=True)
+                with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=lstm_amp):
+                    output = manager.lstm(xb)
+                    loss = criterion(output, yb)
+                loss.backward()
+                optimizer.step()
 
     # ---------------------------
     # 4. Train Scikit-Learn Models
     # ---------------------------
-    print("🔍 Fitting Anomaly Detection (Isolation Forest)...")
-    normal_data = np.random.normal(loc=50, scale=10, size=(100, 1))
-    manager.iso_forest.fit(normal_data)
-
-    print("🌲 Training Risk Classifier (Random Forest)...")
-    X_rf = np.random.rand(100, 3)
-    y_rf = np.random.randint(0, 2, 100)
-    manager.risk_rf.fit(X_rf, y_rf)
-
-    # Save
-    manager.save_models()
-    print("✨ ML Pipeline Training Complete. Models Saved.")
+    if 'iso' in stages:
+        print("🔍 Fitting Anomaly Detection (Isolation Forest)...")
+        # float32 is the trees' input dtype, so fit() skips a conversion copy
+        normal_data = rng.normal(loc=50, scale=10, size=(100, 1)).astype(np.float32, copy=False)
+        # Never ask for more samples per tree than there are rows
+        max_samples = min(manager.iso_forest.max_samples, len(normal_data))
+        manager.iso_forest.set_params(max_samples=max_samples)
+        manager.iso_forest.fit(normal_data)
+
+    if 'rf' in stages:
+        print("🌲 Training Risk Classifier (Random Forest)...")
+        X_rf = rng.random((100, 3), dtype=np.float32)
+        y_rf = rng.integers(0, 2, 100, dtype=np.int8)
+        manager.risk_rf.fit(X_rf, y_rf)
+
+    # Save (only the stages trained in this run; the rest stay as they are on disk)
+    manager.save_models(stages)
+    print(f"✨ ML Pipeline Training Complete. Models Saved ({', '.join(sorted(stages))}).")
 
 if __name__ == "__main__":
     train_initial_models()